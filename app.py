@@ -6,6 +6,7 @@ from dash import Dash, dcc, html, Input, Output
 from dash import dcc
 import plotly.express as px
 import plotly.graph_objects as go
+from plotly.subplots import make_subplots
 import geojson
 import json
 import datetime
@@ -20,6 +21,8 @@ PRODUCT_DROPDOWN = "product_dropdown"
 
 ALERTS_FIGURE = "alerts_map"
 ORIGINS_FIGURE = "origins_map"
+HAZARDS_FIGURE = "hazards_chart"
+TREND_FIGURE = "trend_chart"
 INTERVAL_SLIDER = "interval_slider"
 INTERVAL_TEXT = "interval_text"
 
@@ -39,12 +42,11 @@ def time_slider_to_interval(slider_value):
     ]
 
 
-slider_interval = [
-    0,
-    (rasff.END_YEAR - rasff.START_YEAR) * 12 - rasff.START_MONTH + rasff.END_MONTH,
-]
+# The monthly counts continue past END_YEAR:END_MONTH when newer alerts are ingested
+slider_interval = [0, rasff.monthly.month_count()]
+last_year = rasff.START_YEAR + (rasff.START_MONTH - 1 + slider_interval[1]) // 12
 slider_marks = {0: "1979"}
-for year in range(1982, 2021, 2):
+for year in range(1982, last_year + 1, 2):
     key = (year - rasff.START_YEAR) * 12 - rasff.START_MONTH + 1
     slider_marks[key] = str(year)
 
@@ -96,6 +98,8 @@ app.layout = html.Div(
         ),
         dcc.Graph(id=ALERTS_FIGURE, config={"displayModeBar": False}),
         dcc.Graph(id=ORIGINS_FIGURE, config={"displayModeBar": False}),
+        dcc.Graph(id=HAZARDS_FIGURE, config={"displayModeBar": False}),
+        dcc.Graph(id=TREND_FIGURE, config={"displayModeBar": False}),
         html.Label(id=INTERVAL_TEXT),
         dcc.RangeSlider(
             id=INTERVAL_SLIDER,
@@ -125,9 +129,7 @@ def create_europe_figure(interval, category, product):
         for feature in json_data["features"]:
             countries.append(feature["properties"]["name"])
 
-    alerts = rasff.group_by_country(
-        rasff.select_alerts(interval=interval, category=category, product=product)
-    )
+    alerts = rasff.count_alerts(interval=interval, category=category, product=product)
     # This creates a series with value 0 for all countries not in alerts
     no_data = pd.Series(
         {}, index=[c for c in countries if c not in alerts.index], dtype="int64"
@@ -177,11 +179,9 @@ def create_europe_figure(interval, category, product):
 
 
 def create_world_map(countries, interval, category, product):
-    alerts = rasff.select_alerts(
+    by_country = rasff.count_origins(
         countries=countries, interval=interval, category=category, product=product
     )
-    origins = rasff.select_origins(alerts.index)
-    by_country = rasff.group_by_country(origins)
 
     with open("data/world.json") as file:
         geo_data = geojson.load(file)
@@ -210,6 +210,73 @@ def create_world_map(countries, interval, category, product):
     return fig
 
 
+def create_hazards_figure(countries, interval):
+    """
+    Creates a figure showing hazard categories and the most frequent substances of
+    alerts by the given countries in the time interval.
+    """
+    by_category = rasff.count_hazard_categories(countries, interval)
+    substances = rasff.top_substances(10, countries, interval)
+
+    fig = make_subplots(
+        rows=1,
+        cols=2,
+        specs=[[{"type": "domain"}, {"type": "xy"}]],
+        subplot_titles=("Hazard categories", "Top substances"),
+    )
+    fig.add_trace(
+        go.Pie(
+            labels=by_category.index,
+            values=by_category.values,
+            textinfo="none",
+            hovertemplate="%{value} hazards: %{label}<extra></extra>",
+        ),
+        row=1,
+        col=1,
+    )
+    fig.add_trace(
+        go.Bar(
+            x=substances.values[::-1],
+            y=substances.index[::-1],
+            orientation="h",
+            marker_color=px.colors.sequential.Reds[-3],
+            hovertemplate="%{x} hazards: %{y}<extra></extra>",
+        ),
+        row=1,
+        col=2,
+    )
+    fig.update_layout(
+        margin=dict(l=0, r=0, t=40, b=0), showlegend=False, width=960, height=400
+    )
+    return fig
+
+
+def create_trend_figure(interval, category, product):
+    """
+    Creates a figure showing the number of alerts by month in the given time interval.
+    """
+    by_month = rasff.get_monthly_alerts(interval, category, product)
+
+    fig = go.Figure(
+        [
+            go.Scatter(
+                x=by_month.index,
+                y=by_month.values,
+                mode="lines",
+                line_color=px.colors.sequential.YlGn[-3],
+                hovertemplate="%{y} alerts in %{x|%b %Y}<extra></extra>",
+            )
+        ]
+    )
+    fig.update_layout(
+        margin=dict(l=0, r=0, t=0, b=0),
+        yaxis_title="Alerts",
+        width=960,
+        height=200,
+    )
+    return fig
+
+
 # -----------------------------------------------------------------------------
 # Callbacks
 # -----------------------------------------------------------------------------
@@ -261,5 +328,34 @@ def update_world_map(selected_data, slider_value, category, product):
     return create_world_map(countries, interval, category, product)
 
 
+@app.callback(
+    Output(HAZARDS_FIGURE, "figure"),
+    [
+        Input(ALERTS_FIGURE, "selectedData"),
+        Input(INTERVAL_SLIDER, "value"),
+    ],
+)
+def update_hazards_chart(selected_data, slider_value):
+    interval = time_slider_to_interval(slider_value)
+    if selected_data == None:
+        return create_hazards_figure(None, interval)  # show all hazards
+
+    countries = [x["location"] for x in selected_data["points"]]
+    return create_hazards_figure(countries, interval)
+
+
+@app.callback(
+    Output(TREND_FIGURE, "figure"),
+    [
+        Input(INTERVAL_SLIDER, "value"),
+        Input(CATEGORY_DROPDOWN, "value"),
+        Input(PRODUCT_DROPDOWN, "value"),
+    ],
+)
+def update_trend_chart(slider_value, category, product):
+    interval = time_slider_to_interval(slider_value)
+    return create_trend_figure(interval, category, product)
+
+
 if __name__ == "__main__":
     app.run_server(debug=True)
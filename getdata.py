@@ -5,8 +5,12 @@ import time
 import datetime
 import os
 import threading
+import references
 
 REFS_PER_REQUEST = 100
+REFS_FILE = 'data/raw/references.idx'
+# Plain text reference list, one per line. Read when REFS_FILE does not exist yet
+REFS_TEXT_FILE = 'data/raw/references.txt'
 
 
 def print_progress_bars(fn, prefixes, suffix='Complete', decimals=1, length=100, fill='█'):
@@ -41,64 +45,99 @@ def print_progress_bars(fn, prefixes, suffix='Complete', decimals=1, length=100,
 class ReferenceHTMLParser(HTMLParser):
     def __init__(self):
         super().__init__()
-        self.count = 0  # References found in last html
         self.found_body = False
         self.refs = []
         self.tr_td_count = 0
+        self.in_ref = False
+        self.ref_data = []
 
     def handle_starttag(self, tag, attrs):
+        # A new cell or row implicitly closes the reference cell
+        if tag in ("td", "tr"):
+            self.end_ref()
         if tag == "tbody":
             self.found_body = True
         if tag == "tr" and self.found_body:
             self.tr_td_count = 0
         if tag == "td" and self.found_body:
             self.tr_td_count += 1
+            # The reference is in the 4th column
+            self.in_ref = self.tr_td_count == 4
+
+    def handle_endtag(self, tag):
+        if tag in ("td", "tr", "tbody", "table"):
+            self.end_ref()
+        if tag == "tbody":
+            self.found_body = False
+
+    def end_ref(self):
+        if not self.in_ref:
+            return
+        # Text nodes can be split over several chunks when fed incrementally
+        ref = ''.join(self.ref_data).strip()
+        if ref:
+            self.refs.append(ref)
+        self.in_ref = False
+        self.ref_data = []
 
     def handle_data(self, data):
-        if self.tr_td_count == 4:
-            ref = data.replace("\\n", "")
-            ref = ref.strip()
-            if ref:
-                self.refs.append(ref)
-                self.count += 1
+        if self.in_ref:
+            self.ref_data.append(data)
+
+
+def parse_refs(result, chunk_size=16384):
+    """
+    Parses the references of a notification list response while it is downloaded
+    """
+    parser = ReferenceHTMLParser()
+    if result.encoding is None:
+        result.encoding = 'utf-8'
+    for chunk in result.iter_content(chunk_size=chunk_size, decode_unicode=True):
+        parser.feed(chunk)
+    parser.close()
+    parser.end_ref()
+    return parser.refs
 
 
 def load_refs():
+    if os.path.exists(REFS_FILE):
+        return references.ReferenceIndex.load(REFS_FILE)
     refs = []
     try:
-        with open('data/references.txt', 'r') as f:
+        with open(REFS_TEXT_FILE, 'r') as f:
             for line in f:
                 if line.strip():
                     refs.append(line.strip())
     except:
         pass
-    return refs
+    return references.ReferenceIndex.from_strings(refs)
 
 
-def update_ref():
+def update_ref(full=False):
     print("Updating reference list")
-    parser = ReferenceHTMLParser()
-    # This is a hacky method
-    expected = list(range(0, len(load_refs())))
-    # Emulate do-while(parser.count == 100)
+    index = load_refs()
+    found = []
+    expected = list(range(0, max(len(index), 1)))
+    # Emulate do-while(count == REFS_PER_REQUEST)
     i = 1
-    parser.count = REFS_PER_REQUEST
     error = ''
     # This is called by print_progress_bars
 
     def do_stuff():
         nonlocal i
         nonlocal error
-        nonlocal parser
-        parser.count = 0
         URL = 'https://webgate.ec.europa.eu/rasff-window/portal/?event=notificationsList&StartRow=%d' % i
-        result = requests.get(URL)
+        result = requests.get(URL, stream=True)
         if result.status_code != 200:
             error = "Error: status %s: i = %d" % (result, i)
             return True, [expected], [i]
-        i += parser.count
-        parser.feed(str(result.content))
-        return parser.count < REFS_PER_REQUEST, [expected], [i]
+        refs = parse_refs(result)
+        found.extend(refs)
+        i += len(refs)
+        # The list is ordered newest first, so an incremental update stops at the
+        # first page without new references
+        done = len(refs) < REFS_PER_REQUEST or (not full and not index.missing(refs))
+        return done, [expected], [i]
     stime = time.time()
 
     print_progress_bars(do_stuff, prefixes=['Progress'])
@@ -107,14 +146,10 @@ def update_ref():
         print(error)
 
     print("Time: %s" % (time.time() - stime))
-    print("Found %d references" % len(parser.refs))
+    new_refs = index.missing(found)
+    print("Found %d references, %d new" % (len(found), len(new_refs)))
 
-    out = 'data/raw/references.txt'
-    os.makedirs('data', exist_ok=True)
-    # Save references to unique file
-    s = '\n'.join(parser.refs)
-    with open(out, 'w') as f:
-        f.write(s)
+    index.union(new_refs).save(REFS_FILE)
 
 
 class XmlThread(threading.Thread):
@@ -166,7 +201,7 @@ class XmlThread(threading.Thread):
 def update_xml(thread_count=8):
     print("Updating XML data")
     out = 'data/raw/'
-    refs = load_refs()
+    refs = list(load_refs())
     t = (int)(len(refs) / thread_count)
     # Create thread_count threads. The last thread handles the remaining of references
     thread_list = []
@@ -218,11 +253,12 @@ def update_xml(thread_count=8):
 
 if __name__ == "__main__":
     if len(sys.argv) != 2:
-        print("Usage: update <options>\n  Options are one or more of following:\n   -ref    Update reference list\n   -xml    Update raw xml data")
+        print("Usage: update <options>\n  Options are one or more of following:\n   -ref    Update reference list with new references\n   -ref-all  Rescan the whole reference list\n   -xml    Update raw xml data")
         exit(0)
 
     cmd = {
         "-ref": update_ref,
+        "-ref-all": lambda: update_ref(full=True),
         "-xml": update_xml
     }
 
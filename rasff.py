@@ -1,7 +1,10 @@
 import xml.etree.ElementTree as et
+import numpy as np
 import pandas as pd
 import datetime
 import os.path
+import references
+import snapshot
 
 # -----------------------------------------------------------------------------
 # Time
@@ -12,11 +15,36 @@ START_MONTH = 9  # september
 END_YEAR = 2020
 END_MONTH = 1  # januar
 
+# Number of months in the interval. Months are numbered from 0 at START_YEAR:START_MONTH
+MONTH_COUNT = (END_YEAR - START_YEAR) * 12 + END_MONTH - START_MONTH
+
+
+def to_month(date):
+    """
+    Converts a datetime to its month number
+    """
+    return (date.year - START_YEAR) * 12 + date.month - START_MONTH
+
+
+def interval_to_months(interval=None, month_count=MONTH_COUNT):
+    """
+    Converts a datetime interval to an inclusive range of month numbers below
+    month_count. If interval is None, the range covers all months.
+    """
+    if interval is None:
+        return 0, month_count - 1
+    return max(to_month(interval[0]), 0), min(to_month(interval[1]), month_count - 1)
+
 
 # -----------------------------------------------------------------------------
 # Data loading
 # -----------------------------------------------------------------------------
+RAW_DATA_DIR = "data/raw"
 RAW_DATA_FILE = "data/data.xml"
+SNAPSHOT_FILE = "data/data.snapshot"
+# Bump when the columns of the snapshot or their coding change
+SNAPSHOT_SCHEMA = 3
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8"?>'
 
 
 def create_dataframes():
@@ -38,6 +66,7 @@ def create_dataframes():
     alert_cols = [
         "Country",
         "Date",
+        "Month",
         "Subject",
         "Risk",
         "Action",
@@ -52,26 +81,30 @@ def create_dataframes():
 
     origin_cols = ["Reference", "Country"]
     origin_rows = []
+    seen = set()
 
     init_raw_data()
 
     xtree = et.parse(RAW_DATA_FILE)
     xroot = xtree.getroot()
     for entry in xroot:
-        notification = entry.find("Notification")
-        details = notification.find("Details")
-
-        # Filter only alerts
-        if "-  alert  -" not in details.find("NotificationType").text:
+        alert = alert_details(entry)
+        if alert is None:
             continue
+        notification, details, date = alert
 
         # Filter date
-        date = parse_date(details.find("DateOfCase").text)
         if date.year > END_YEAR or (date.year == END_YEAR and date.month >= END_MONTH):
             continue
 
-        subject = details.find("Subject").text
+        # A notification can be scraped more than once. Keep the first copy, so its
+        # origins and hazards are not counted twice either
         reference = details.find("Reference").text
+        if reference in seen:
+            continue
+        seen.add(reference)
+
+        subject = details.find("Subject").text
         action = details.find("ActionTaken").text
         country = sanitize_country(details.find("NotificationFrom").text)
         distribution_status = details.find("DistributionStatus").text
@@ -84,6 +117,7 @@ def create_dataframes():
             (
                 country,
                 date,
+                to_month(date),
                 subject,
                 risk,
                 action,
@@ -109,6 +143,22 @@ def create_dataframes():
     return alerts_df, hazards_df, origins_df
 
 
+def alert_details(entry):
+    """
+    Returns the notification, its details and date if the entry is an alert, otherwise
+    None.
+    """
+    notification = entry.find("Notification")
+    details = notification.find("Details")
+
+    # Filter only alerts
+    if "-  alert  -" not in details.find("NotificationType").text:
+        return None
+
+    date = parse_date(details.find("DateOfCase").text)
+    return notification, details, date
+
+
 def parse_date(date_str):
     """
     Parses a date string into a datetime object
@@ -125,7 +175,7 @@ def sanitize_country(country: str):
     return country.strip()
 
 
-def init_raw_data(raw_dir="data/raw", out=RAW_DATA_FILE):
+def init_raw_data(raw_dir=RAW_DATA_DIR, out=RAW_DATA_FILE):
     """
     Creates a combined xml file containing the scraped data.
     """
@@ -135,7 +185,7 @@ def init_raw_data(raw_dir="data/raw", out=RAW_DATA_FILE):
     for filename in os.listdir(raw_dir):
         if filename.endswith(".xml"):
             with open(os.path.join(raw_dir, filename), "r") as f:
-                content = f.read().replace('<?xml version="1.0" encoding="UTF-8"?>', "")
+                content = f.read().replace(XML_DECLARATION, "")
                 data += content
 
     data += "\n</Data>"
@@ -143,51 +193,648 @@ def init_raw_data(raw_dir="data/raw", out=RAW_DATA_FILE):
         f.write(data)
 
 
+# -----------------------------------------------------------------------------
+# Aggregates
+# -----------------------------------------------------------------------------
+
+
+def count_cumulative(months, **keys):
+    """
+    Counts rows by each combination of the given coded key columns and by month.
+
+    Returns a dict of arrays with one entry for every combination and month with counts,
+    sorted by combination and month:
+        "Key"     combination number << 16 | month
+        "Count"   counts accumulated over the months of the combination
+    and one item for every combination:
+        "Offsets" start of the entries of each combination, followed by the end
+        <key>     code of each key column
+    Only combinations and months that occur are stored.
+    """
+    months = np.asarray(months, dtype=np.int64)
+
+    # Skip rows outside the time interval and rows with missing keys
+    valid = (months >= 0) & (months < MONTH_COUNT)
+    for codes in keys.values():
+        valid &= np.asarray(codes) >= 0
+
+    # Sort rows by combination and month
+    rows = [np.asarray(codes, dtype=np.int64)[valid] for codes in keys.values()]
+    rows.append(months[valid])
+    order = np.lexsort(rows[::-1])
+    rows = [r[order] for r in rows]
+
+    def changes(columns, length):
+        changed = np.ones(length, dtype=bool)
+        for c in columns:
+            changed[1:] |= c[1:] != c[:-1]
+        return changed
+
+    entry_start = np.flatnonzero(changes(rows, len(order)))
+    entry_count = np.diff(np.append(entry_start, len(order)))
+    entries = [r[entry_start] for r in rows]
+
+    new_combination = changes(entries[:-1], len(entry_start))
+    combination = np.cumsum(new_combination) - 1
+    offsets = np.append(np.flatnonzero(new_combination), len(entry_start))
+
+    # Accumulate the counts within each combination
+    total = np.cumsum(entry_count)
+    before = np.append(0, total)[offsets[:-1]]
+    counts = {
+        "Key": combination << 16 | entries[-1],
+        "Count": total - np.repeat(before, np.diff(offsets)),
+        "Offsets": offsets,
+    }
+    for name, codes in zip(keys, entries):
+        counts[name] = codes[offsets[:-1]]
+    return counts
+
+
+def query_cumulative(counts, label, table, interval=None, **filters):
+    """
+    Returns a series with the counts of count_cumulative in the given time interval,
+    summed by the key column label and indexed by the names in table.
+
+    Each filter is a key column and a code or list of codes that combinations must
+    have. Only the combinations that pass the filters are looked up, so a query costs
+    the number of those combinations rather than the number of counted rows.
+    """
+    lo, hi = interval_to_months(interval)
+    labels = indexes[table]
+    if hi < lo:
+        return pd.Series([], index=labels[:0], dtype="int64")
+
+    selected = np.ones(len(counts["Offsets"]) - 1, dtype=bool)
+    for name, codes in filters.items():
+        if codes is None:
+            continue
+        selected &= np.isin(counts[name], codes)
+    combination = np.flatnonzero(selected)
+
+    # The count of a combination up to a month is the last entry at or before it
+    def accumulated(keys, side):
+        i = np.searchsorted(counts["Key"], keys, side=side)
+        found = i > counts["Offsets"][combination]
+        return np.where(found, counts["Count"][np.maximum(i - 1, 0)], 0)
+
+    in_interval = accumulated(combination << 16 | hi, "right") - accumulated(
+        combination << 16 | lo, "left"
+    )
+    by_label = np.bincount(
+        counts[label][combination], weights=in_interval, minlength=len(labels)
+    )
+    by_label = pd.Series(by_label.astype("int64"), index=labels)
+    return by_label[by_label > 0]
+
+
+def count_aggregates(columns):
+    """
+    Counts the aggregates queries are answered from. Returns a dict of aggregate name
+    to the arrays of count_cumulative.
+    """
+    rows = np.arange(len(columns["Month"]))
+    origin_rows = np.repeat(rows, np.diff(columns["OriginOffsets"]))
+    hazard_rows = np.repeat(rows, np.diff(columns["HazardOffsets"]))
+    month = columns["Month"]
+    country = columns["Country"]
+    category = columns["ProductCategory"]
+    product = columns["Product"]
+    return {
+        # (country, product category) -> alerts by month
+        "ProductCategoryCounts": count_cumulative(
+            month, Country=country, ProductCategory=category
+        ),
+        # (country, hazard category) -> hazards by month
+        "HazardCategoryCounts": count_cumulative(
+            month[hazard_rows],
+            Country=country[hazard_rows],
+            HazardCategory=columns["HazardCategory"],
+        ),
+        # (country, substance) -> hazards by month
+        "SubstanceCounts": count_cumulative(
+            month[hazard_rows],
+            Country=country[hazard_rows],
+            Substance=columns["Substance"],
+        ),
+        # (notifying country, origin country) -> origins by month. The flows of every
+        # product category and of every product are counted as well, so all slices
+        # are precomputed
+        "FlowCounts": count_cumulative(
+            month[origin_rows], Country=country[origin_rows], Origin=columns["Origin"]
+        ),
+        "CategoryFlowCounts": count_cumulative(
+            month[origin_rows],
+            ProductCategory=category[origin_rows],
+            Country=country[origin_rows],
+            Origin=columns["Origin"],
+        ),
+        "ProductFlowCounts": count_cumulative(
+            month[origin_rows],
+            ProductCategory=category[origin_rows],
+            Product=product[origin_rows],
+            Country=country[origin_rows],
+            Origin=columns["Origin"],
+        ),
+    }
+
+
+# -----------------------------------------------------------------------------
+# Snapshot
+# -----------------------------------------------------------------------------
+
+
+def create_snapshot(out=SNAPSHOT_FILE):
+    """
+    Creates a snapshot of the alerts in the raw data.
+
+    Alerts are sorted by month and strings are coded against sorted tables. The origins
+    and hazards of alert i are stored at offsets[i]:offsets[i + 1] of their columns.
+    The aggregates are counted here as well, so processes that map the snapshot share
+    them instead of each building a copy.
+    """
+    alerts_df, hazards_df, origins_df = create_dataframes()
+    alerts_df = alerts_df.sort_values("Month", kind="stable")
+
+    tables = {
+        "Country": sorted(set(alerts_df["Country"]) | set(origins_df["Country"])),
+        "ProductCategory": sorted(alerts_df["ProductCategory"].dropna().unique()),
+        "Product": sorted(alerts_df["Product"].dropna().unique()),
+        "Reference": sorted(alerts_df.index),
+        "Substance": sorted(hazards_df["Substance"].dropna().unique()),
+        "HazardCategory": sorted(hazards_df["Category"].dropna().unique()),
+    }
+
+    def encode(values, table):
+        return pd.Categorical(values, categories=tables[table]).codes
+
+    def group_rows(refs):
+        # Sorts rows of origins or hazards by alert and computes the offsets
+        rows = alerts_df.index.get_indexer(refs)
+        order = np.argsort(rows, kind="stable")
+        order = order[rows[order] >= 0]
+        counts = np.bincount(rows[order], minlength=len(alerts_df))
+        return order, np.concatenate([[0], np.cumsum(counts)])
+
+    origin_order, origin_offsets = group_rows(origins_df["Reference"])
+    hazard_order, hazard_offsets = group_rows(hazards_df["Reference"])
+    origins_df = origins_df.iloc[origin_order]
+    hazards_df = hazards_df.iloc[hazard_order]
+
+    columns = {
+        "Month": alerts_df["Month"].to_numpy(dtype="int16"),
+        "Country": encode(alerts_df["Country"], "Country").astype("int16"),
+        "ProductCategory": encode(
+            alerts_df["ProductCategory"], "ProductCategory"
+        ).astype("int16"),
+        "Product": encode(alerts_df["Product"], "Product").astype("int32"),
+        "Reference": encode(alerts_df.index, "Reference").astype("int32"),
+        "OriginOffsets": origin_offsets.astype("int32"),
+        "Origin": encode(origins_df["Country"], "Country").astype("int16"),
+        "HazardOffsets": hazard_offsets.astype("int32"),
+        "Substance": encode(hazards_df["Substance"], "Substance").astype("int32"),
+        "HazardCategory": encode(hazards_df["Category"], "HazardCategory").astype(
+            "int16"
+        ),
+    }
+    # Aggregates are stored as columns named <aggregate>.<field>
+    for name, counts in count_aggregates(columns).items():
+        for field, values in counts.items():
+            dtype = "int64" if field == "Key" else "int32"
+            columns[name + "." + field] = values.astype(dtype)
+    snapshot.write_snapshot(out, columns, tables, snapshot_meta())
+
+
+def snapshot_meta():
+    """
+    Returns the metadata a snapshot must have to be used: month numbers depend on the
+    start of the time interval and the columns on the schema.
+    """
+    return {
+        "Schema": SNAPSHOT_SCHEMA,
+        "StartYear": START_YEAR,
+        "StartMonth": START_MONTH,
+        "MonthCount": MONTH_COUNT,
+    }
+
+
+def load_data():
+    """
+    Maps the snapshot of the alerts. The snapshot is created first if it is missing,
+    older than the raw data or built with a different schema or time interval.
+    """
+    init_raw_data()
+    if not os.path.exists(SNAPSHOT_FILE) or (
+        os.path.getmtime(SNAPSHOT_FILE) < os.path.getmtime(RAW_DATA_FILE)
+    ):
+        create_snapshot()
+    try:
+        data = snapshot.load_snapshot(SNAPSHOT_FILE)
+    except ValueError:
+        data = None
+    if data is None or data[2] != snapshot_meta():
+        create_snapshot()
+        data = snapshot.load_snapshot(SNAPSHOT_FILE)
+    return data
+
+
+def split_aggregates(columns):
+    """
+    Returns a dict of aggregate name to the dict of its columns in the snapshot.
+    """
+    aggregates = {}
+    for name, column in columns.items():
+        if "." in name:
+            aggregate, field = name.split(".")
+            aggregates.setdefault(aggregate, {})[field] = column
+    return aggregates
+
+
 # Create global variables
-alerts_df, hazards_df, origins_df = create_dataframes()
+columns, tables, _ = load_data()
+aggregates = split_aggregates(columns)
+indexes = {
+    name: pd.Index(tables[name])
+    for name in ("Country", "ProductCategory", "Product", "Substance", "HazardCategory")
+}
+country_index = indexes["Country"]
+
+
+# -----------------------------------------------------------------------------
+# Monthly counts
+# -----------------------------------------------------------------------------
+MONTHLY_FILE = "data/monthly.snapshot"
+# Bump when the columns of the monthly counts change
+MONTHLY_SCHEMA = 1
+
+
+class MonthlyCounts:
+    """
+    Alerts by month for every (product category, product) key. (category, None) holds
+    the alerts of a whole category and (None, None) all alerts.
+
+    Unlike the other aggregates the monthly counts are updated in place when scraped
+    notifications are ingested, and their months continue past END_YEAR:END_MONTH.
+    They are saved to MONTHLY_FILE together with the references already counted.
+    """
+
+    def __init__(self, keys, counts, counted, ingested_until):
+        self.keys = list(keys)
+        self.rows = {key: i for i, key in enumerate(self.keys)}
+        self.counts = counts  # keys x months
+        self.counted = counted  # ReferenceIndex of the alerts counted
+        self.ingested_until = ingested_until  # mtime of the last raw file ingested
+        self.dates = month_dates(counts.shape[1])
+
+    @classmethod
+    def from_snapshot(cls):
+        """
+        Counts the alerts in the snapshot. No raw file is considered ingested: the
+        snapshot leaves out alerts after END_YEAR:END_MONTH, so every raw file has to be
+        ingested again. Alerts already in the snapshot are skipped as counted.
+        """
+        monthly = cls(
+            [],
+            np.zeros((0, MONTH_COUNT), dtype=np.int32),
+            references.ReferenceIndex.from_strings(tables["Reference"]),
+            0,
+        )
+        # Code -1 of a missing value takes the None appended to the table
+        monthly.add(
+            columns["Month"],
+            pd.Index(tables["ProductCategory"] + [None]).take(
+                columns["ProductCategory"]
+            ),
+            pd.Index(tables["Product"] + [None]).take(columns["Product"]),
+        )
+        return monthly
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads monthly counts saved with save, or returns None if they were counted with
+        a different schema or time interval.
+        """
+        saved, saved_tables, meta = snapshot.load_snapshot(path)
+        expected = {
+            "Schema": MONTHLY_SCHEMA,
+            "StartYear": START_YEAR,
+            "StartMonth": START_MONTH,
+        }
+        if any(meta.get(name) != value for name, value in expected.items()):
+            return None
+        keys = zip(saved_tables["ProductCategory"], saved_tables["Product"])
+        counts = saved["Counts"].reshape(
+            len(saved_tables["Product"]), meta["MonthCount"]
+        )
+        counted = references.ReferenceIndex.from_sorted(
+            saved["ReferenceKey"], saved_tables["OtherReference"]
+        )
+        return cls(keys, counts, counted, meta["IngestedUntil"])
+
+    def save(self, path):
+        snapshot.write_snapshot(
+            path,
+            {"Counts": self.counts.ravel(), "ReferenceKey": self.counted.keys},
+            {
+                "ProductCategory": [key[0] for key in self.keys],
+                "Product": [key[1] for key in self.keys],
+                "OtherReference": list(self.counted.others),
+            },
+            {
+                "Schema": MONTHLY_SCHEMA,
+                "StartYear": START_YEAR,
+                "StartMonth": START_MONTH,
+                "MonthCount": self.counts.shape[1],
+                "IngestedUntil": self.ingested_until,
+            },
+        )
+
+    def month_count(self):
+        return self.counts.shape[1]
+
+    def add(self, months, categories, products):
+        """
+        Adds alerts with the given months, product categories and products.
+        """
+        alerts = pd.DataFrame(
+            {"Month": months, "ProductCategory": categories, "Product": products}
+        )
+        alerts = alerts[alerts["Month"] >= 0]
+        if len(alerts) == 0:
+            return
+
+        # Mapped counts are read-only, and new months widen the counts
+        month_count = max(self.month_count(), alerts["Month"].max() + 1)
+        counts = np.zeros((len(self.keys), month_count), dtype=np.int32)
+        counts[:, : self.month_count()] = self.counts
+        self.counts = counts
+        if len(self.dates) != month_count:
+            self.dates = month_dates(month_count)
+
+        self._add_months((None, None), alerts["Month"])
+        for category, group in alerts.groupby("ProductCategory"):
+            self._add_months((category, None), group["Month"])
+        for key, group in alerts.groupby(["ProductCategory", "Product"]):
+            self._add_months(key, group["Month"])
+
+    def _add_months(self, key, months):
+        if key not in self.rows:
+            self.rows[key] = len(self.keys)
+            self.keys.append(key)
+            self.counts = np.vstack(
+                [self.counts, np.zeros((1, self.month_count()), dtype=np.int32)]
+            )
+        self.counts[self.rows[key]] += np.bincount(
+            np.asarray(months, dtype=np.int64), minlength=self.month_count()
+        ).astype(np.int32)
+
+    def ingest(self, data):
+        """
+        Adds the alerts in scraped xml data that are not counted yet. Returns the number
+        of alerts added.
+        """
+        root = et.fromstring("<Data>" + data.replace(XML_DECLARATION, "") + "</Data>")
+        alerts = {}
+        for entry in root:
+            alert = alert_details(entry)
+            if alert is None:
+                continue
+            _, details, date = alert
+            alerts.setdefault(
+                details.find("Reference").text,
+                (
+                    to_month(date),
+                    details.find("ProductCategory").text,
+                    details.find("Product").text,
+                ),
+            )
+
+        new_refs = self.counted.missing(alerts)
+        if new_refs:
+            months, categories, products = zip(*(alerts[r] for r in new_refs))
+            self.add(months, categories, products)
+            self.counted = self.counted.union(new_refs)
+        return len(new_refs)
+
+    def ingest_raw_files(self, raw_dir=RAW_DATA_DIR):
+        """
+        Ingests the scraped xml files changed since the last ingest. Returns the number
+        of files read.
+        """
+        if not os.path.isdir(raw_dir):
+            return 0
+        paths = [
+            os.path.join(raw_dir, filename)
+            for filename in sorted(os.listdir(raw_dir))
+            if filename.endswith(".xml")
+        ]
+        paths = [p for p in paths if os.path.getmtime(p) > self.ingested_until]
+        for path in paths:
+            with open(path, "r") as f:
+                self.ingest(f.read())
+            self.ingested_until = max(self.ingested_until, os.path.getmtime(path))
+        return len(paths)
+
+    def get(self, lo, hi, category=None, product=None):
+        """
+        Returns a series with the alerts by month in the inclusive month range lo..hi.
+        """
+        row = self.rows.get((category, product))
+        if row is None:
+            counts = np.zeros(max(hi - lo + 1, 0), dtype=np.int32)
+        else:
+            counts = self.counts[row, lo : hi + 1]
+        return pd.Series(counts, index=self.dates[lo : hi + 1])
+
+
+def month_dates(month_count):
+    """
+    Returns the first day of each month from START_YEAR:START_MONTH
+    """
+    return pd.date_range(
+        datetime.datetime(START_YEAR, START_MONTH, 1), periods=month_count, freq="MS"
+    )
+
+
+def load_monthly_counts():
+    """
+    Loads the monthly counts and ingests the scraped files changed since the last
+    ingest. The counts are counted from the snapshot if they are missing or older than
+    it, and then every scraped file is ingested again.
+    """
+    monthly = None
+    if os.path.exists(MONTHLY_FILE) and (
+        os.path.getmtime(MONTHLY_FILE) >= os.path.getmtime(SNAPSHOT_FILE)
+    ):
+        try:
+            monthly = MonthlyCounts.load(MONTHLY_FILE)
+        except ValueError:
+            pass
+    changed = monthly is None
+    if changed:
+        monthly = MonthlyCounts.from_snapshot()
+    if monthly.ingest_raw_files() or changed:
+        monthly.save(MONTHLY_FILE)
+    return monthly
+
+
+def ingest_notifications(data):
+    """
+    Adds the alerts in scraped xml data to the monthly counts and saves them. Alerts
+    that are already counted are skipped. Returns the number of alerts added.
+
+    Only the monthly counts, and so the trend chart, include ingested alerts. The
+    snapshot, and with it the maps and the hazard panel, is built from the combined
+    raw data in RAW_DATA_FILE. It only includes new notifications once that file is
+    combined again and the snapshot rebuilt, and never alerts after
+    END_YEAR:END_MONTH. Until then the trend chart disagrees with the other views.
+
+    Rebuilding the snapshot recounts the monthly counts from it and ingests every file
+    in RAW_DATA_DIR again, so alerts after END_YEAR:END_MONTH in those files are kept.
+    Data passed here that is not saved in RAW_DATA_DIR is lost on a recount.
+    """
+    added = monthly.ingest(data)
+    if added:
+        monthly.save(MONTHLY_FILE)
+    return added
+
+
+monthly = load_monthly_counts()
+
 
 # -----------------------------------------------------------------------------
 # Data retrieval
 # -----------------------------------------------------------------------------
 
 
+def country_codes(countries):
+    """
+    Returns the codes of the given country or list of countries, leaving out unknown
+    countries. Returns None if countries is None.
+    """
+    if countries is None:
+        return None
+    if type(countries) is not list:
+        countries = [countries]
+    codes = country_index.get_indexer(countries)
+    return codes[codes >= 0]
+
+
+def _code(table, value):
+    """
+    Returns the code of value in the given table, or -1 if it is not in the table.
+    """
+    return indexes[table].get_indexer([value])[0]
+
+
 def select_alerts(countries=None, interval=None, category=None, product=None):
     """
-    Selects all alerts by specified country in given time interval.
+    Selects the rows of all alerts by specified country in given time interval.
     If country is None, the alerts are not filtered based on country.
     If interval is None, the alerts are not filtered on date.
     """
-    alerts = alerts_df
-    if interval is not None:
-        alerts = alerts[
-            (alerts["Date"] >= interval[0]) & (alerts["Date"] <= interval[1])
-        ]
+    # Alerts are sorted by month
+    lo, hi = interval_to_months(interval)
+    month = columns["Month"]
+    rows = np.arange(
+        np.searchsorted(month, lo, side="left"),
+        np.searchsorted(month, hi, side="right"),
+    )
     if countries is not None:
-        if type(countries) is list:
-            alerts = alerts[alerts["Country"].isin(countries)]
-        else:
-            alerts = alerts[alerts["Country"] == countries]
+        if type(countries) is not list:
+            countries = [countries]
+        codes = country_index.get_indexer(countries)
+        rows = rows[np.isin(columns["Country"][rows], codes[codes >= 0])]
     if category is not None:
-        alerts = alerts[alerts["ProductCategory"] == category]
+        # Code -1 is also the code of a missing value, so unknown names select nothing
+        code = _code("ProductCategory", category)
+        if code < 0:
+            return rows[:0]
+        rows = rows[columns["ProductCategory"][rows] == code]
         if product is not None:
-            alerts = alerts[alerts["Product"] == product]
-    return alerts
+            code = _code("Product", product)
+            if code < 0:
+                return rows[:0]
+            rows = rows[columns["Product"][rows] == code]
+    return rows
+
+
+def select_origins(rows=None):
+    """
+    Return the origin country codes of the specified alert rows.
+    """
+    if rows is None:
+        return columns["Origin"]
+    offsets = columns["OriginOffsets"]
+    starts = offsets[rows]
+    lengths = offsets[rows + 1] - starts
+    # Origin i of the selection is at starts[j] + i - (origins before alert j)
+    before = np.cumsum(lengths) - lengths
+    positions = np.arange(lengths.sum()) + np.repeat(starts - before, lengths)
+    return columns["Origin"][positions]
+
+
+def count_alerts(countries=None, interval=None, category=None, product=None):
+    """
+    Return a series with the number of alerts by country for the specified countries
+    in given time interval.
+    """
+    rows = select_alerts(countries, interval, category, product)
+    return group_by_country(columns["Country"][rows])
+
+
+def get_monthly_alerts(interval=None, category=None, product=None):
+    """
+    Return a series with the number of alerts by month in given time interval, indexed
+    by the first day of each month. Months after END_YEAR:END_MONTH are included when
+    ingested notifications have them.
+    """
+    if category is None:
+        product = None
+    lo, hi = interval_to_months(interval, monthly.month_count())
+    return monthly.get(lo, hi, category, product)
 
 
-def select_origins(refs=None):
+def count_origins(countries=None, interval=None, category=None, product=None):
     """
-    Return origins grouped by country for the specified references.
+    Return a series with the number of origins by country for alerts by the specified
+    countries in given time interval.
+    If countries is None, the origins of alerts by all countries are counted.
     """
-    if refs is None:
-        return origins_df
-    return origins_df[origins_df["Reference"].isin(refs)]
+    countries = country_codes(countries)
+    if category is None:
+        return query_cumulative(
+            aggregates["FlowCounts"], "Origin", "Country", interval, Country=countries
+        )
+    category = _code("ProductCategory", category)
+    if product is None:
+        return query_cumulative(
+            aggregates["CategoryFlowCounts"],
+            "Origin",
+            "Country",
+            interval,
+            ProductCategory=category,
+            Country=countries,
+        )
+    return query_cumulative(
+        aggregates["ProductFlowCounts"],
+        "Origin",
+        "Country",
+        interval,
+        ProductCategory=category,
+        Product=_code("Product", product),
+        Country=countries,
+    )
 
 
-def group_by_country(data):
+def group_by_country(codes):
     """
-    Return a series with data grouped by countries and counted.
+    Return a series with country codes grouped by countries and counted.
     """
-    return data.groupby("Country")["Country"].count()
+    counts = np.bincount(codes[codes >= 0], minlength=len(country_index))
+    counts = pd.Series(counts, index=country_index, name="Country")
+    return counts[counts > 0]
 
 
 def get_pies(country=None, interval=None):
@@ -195,21 +842,49 @@ def get_pies(country=None, interval=None):
     Returns df with columns=['ProductCategory', 'Count']
             dff with columns=['Category', 'Count']
     """
+    df = query_cumulative(
+        aggregates["ProductCategoryCounts"],
+        "ProductCategory",
+        "ProductCategory",
+        interval,
+        Country=country_codes(country),
+    )
+    df = df.rename_axis("ProductCategory").rename("Count").reset_index()
 
-    df = select_alerts(country, interval)
-    dff = hazards_df[hazards_df["Reference"].isin(df.index)]
-    df = df.groupby("ProductCategory")["ProductCategory"].count()
-    df = df.to_frame()
-    df = df.rename(columns={"ProductCategory": "Count"})
-    df = df.reset_index()
-
-    dff = dff.groupby("Category")["Category"].count()
-    dff = dff.to_frame()
-    dff = dff.rename(columns={"Category": "Count"})
-    dff = dff.reset_index()
+    dff = count_hazard_categories(country, interval)
+    dff = dff.rename_axis("Category").rename("Count").reset_index()
     return df, dff
 
 
+def count_hazard_categories(countries=None, interval=None):
+    """
+    Return a series with the number of hazards by hazard category for alerts by the
+    specified countries in given time interval.
+    """
+    return query_cumulative(
+        aggregates["HazardCategoryCounts"],
+        "HazardCategory",
+        "HazardCategory",
+        interval,
+        Country=country_codes(countries),
+    )
+
+
+def top_substances(n=10, countries=None, interval=None):
+    """
+    Return a series with the n most frequent hazard substances for alerts by the
+    specified countries in given time interval, sorted by count.
+    """
+    counts = query_cumulative(
+        aggregates["SubstanceCounts"],
+        "Substance",
+        "Substance",
+        interval,
+        Country=country_codes(countries),
+    )
+    return counts.nlargest(n)
+
+
 def get_product_categories():
     """
     Returns a dict of product category mapping to list of products in that category.
@@ -219,15 +894,22 @@ def get_product_categories():
         t1 = 2 if x.endswith("(obsolete)") else (1 if x.endswith("(other)") else 0)
         return (t1, x)
 
-    alerts = select_alerts()[["ProductCategory", "Product"]]
+    # Unique (category, product) code pairs
+    pairs = np.unique(
+        np.stack([columns["ProductCategory"], columns["Product"]], axis=1), axis=0
+    )
+    pairs = pairs[(pairs >= 0).all(axis=1)]
 
-    cat_list = sorted(alerts.ProductCategory.unique().tolist(), key=key)
+    cat_list = sorted(
+        {tables["ProductCategory"][c] for c in np.unique(pairs[:, 0])}, key=key
+    )
     categories = [{"label": c, "value": c} for c in cat_list]
 
     products = {}
     for c in cat_list:
+        code = _code("ProductCategory", c)
         prod_list = sorted(
-            alerts[alerts.ProductCategory == c].Product.unique().tolist(), key=key
+            [tables["Product"][p] for p in pairs[pairs[:, 0] == code, 1]], key=key
         )
         prods = [{"label": p, "value": p} for p in prod_list]
         products[c] = prods
@@ -250,12 +932,12 @@ if __name__ == "__main__":
         )
 
     # alerts = select_alerts(countries=['Germany', 'Italy'], interval=[datetime.datetime(2019, 10, 1), datetime.datetime(2019,10,31)])
-    # origins = select_origins(alerts.index)
-    # print('Alerts by country',group_by_country(alerts))
+    # origins = select_origins(alerts)
+    # print('Alerts by country',group_by_country(columns['Country'][alerts]))
     # print('Origins by country',group_by_country(origins))
 
-    # dates = select_alerts()['Date']
-    # print('min date', min(dates))
-    # print('max date', max(dates))
+    # months = columns['Month']
+    # print('min month', min(months))
+    # print('max month', max(months))
 
     get_product_categories()
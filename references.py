@@ -0,0 +1,206 @@
+import bisect
+import os
+import numpy as np
+import snapshot
+
+# -----------------------------------------------------------------------------
+# Reference keys
+# -----------------------------------------------------------------------------
+# A reference such as "2020.3863" or "2017.CJC" is stored as one integer key
+#
+#   year << 40 | sequence
+#
+# A numeric sequence is stored as width << 32 | value, so leading zeros are kept.
+# A sequence of letters is stored as LETTERS | bijective base-26 value. References
+# that do not follow either pattern are kept as strings.
+YEAR_SHIFT = 40
+WIDTH_SHIFT = 32
+LETTERS = 1 << 39
+MAX_DIGITS = 9
+MAX_LETTERS = 7
+
+
+def encode_reference(ref):
+    """
+    Returns the integer key of a reference, or None if the reference can not be encoded
+    """
+    year, dot, seq = ref.partition(".")
+    if not dot or len(year) != 4 or not year.isdigit() or not seq.isascii():
+        return None
+    if seq.isdigit() and len(seq) <= MAX_DIGITS:
+        code = len(seq) << WIDTH_SHIFT | int(seq)
+    elif seq.isalpha() and seq.isupper() and len(seq) <= MAX_LETTERS:
+        code = 0
+        for c in seq:
+            code = code * 26 + ord(c) - ord("A") + 1
+        code |= LETTERS
+    else:
+        return None
+    return int(year) << YEAR_SHIFT | code
+
+
+def decode_reference(key):
+    """
+    Returns the reference of an integer key
+    """
+    key = int(key)
+    year = key >> YEAR_SHIFT
+    code = key & ((1 << YEAR_SHIFT) - 1)
+    if code & LETTERS:
+        code &= ~LETTERS
+        seq = ""
+        while code:
+            code, c = divmod(code - 1, 26)
+            seq = chr(ord("A") + c) + seq
+    else:
+        width = code >> WIDTH_SHIFT
+        seq = str(code & ((1 << WIDTH_SHIFT) - 1)).zfill(width)
+    return "%04d.%s" % (year, seq)
+
+
+# -----------------------------------------------------------------------------
+# Reference index
+# -----------------------------------------------------------------------------
+
+
+class ReferenceIndex:
+    """
+    A sorted set of notification references.
+    """
+
+    def __init__(self, keys=(), others=()):
+        self.keys = np.unique(np.asarray(keys, dtype=np.int64))
+        self.others = sorted(set(others))
+
+    @classmethod
+    def from_strings(cls, refs):
+        keys, others = _encode_all(refs)
+        return cls(keys, others)
+
+    @classmethod
+    def from_sorted(cls, keys, others):
+        """
+        Returns an index of keys and other references that are already sorted and
+        unique, such as saved ones. The keys are used without a copy, so they can be
+        memory mapped.
+        """
+        index = cls.__new__(cls)
+        index.keys = keys
+        index.others = list(others)
+        return index
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads an index saved with save. The keys are memory mapped.
+        """
+        columns, tables, _ = snapshot.load_snapshot(path)
+        return cls.from_sorted(columns["Key"], tables["Other"])
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        snapshot.write_snapshot(path, {"Key": self.keys}, {"Other": self.others})
+
+    def __len__(self):
+        return len(self.keys) + len(self.others)
+
+    def __iter__(self):
+        for key in self.keys:
+            yield decode_reference(key)
+        yield from self.others
+
+    def __contains__(self, ref):
+        key = encode_reference(ref)
+        if key is None:
+            i = bisect.bisect_left(self.others, ref)
+            return i < len(self.others) and self.others[i] == ref
+        i = np.searchsorted(self.keys, key)
+        return i < len(self.keys) and self.keys[i] == key
+
+    def missing(self, refs):
+        """
+        Returns the references in refs that are not in the index, in the given order
+        """
+        refs = list(refs)
+        keys = np.array([encode_reference(r) or -1 for r in refs], dtype=np.int64)
+        known = np.zeros(len(refs), dtype=bool)
+        if len(self.keys):
+            i = np.searchsorted(self.keys, keys).clip(max=len(self.keys) - 1)
+            known = self.keys[i] == keys
+        return [
+            r
+            for r, key, k in zip(refs, keys, known)
+            if not (k or (key == -1 and r in self))
+        ]
+
+    def union(self, refs):
+        """
+        Returns a new index with the references of this index and refs
+        """
+        keys, others = _encode_all(refs)
+        return ReferenceIndex(
+            np.concatenate([self.keys, keys]), list(self.others) + others
+        )
+
+
+def _encode_all(refs):
+    keys, others = [], []
+    for ref in refs:
+        key = encode_reference(ref)
+        if key is None:
+            others.append(ref)
+        else:
+            keys.append(key)
+    return np.array(keys, dtype=np.int64), others
+
+
+# -----------------------------------------------------------------------------
+# Test
+# -----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    import tempfile
+
+    # Run some tests
+    refs = [
+        "2020.3863",  # numeric
+        "2016.0266",  # leading zero
+        "1988.05",  # short numeric with leading zero
+        "2019.0",
+        "2017.CJC",  # letters
+        "2017.A",
+        "2017.ZZ",
+        "2014.1120389237",  # too many digits, kept as string
+        "17-836",  # no year, kept as string
+        "2001.HA-C",
+    ]
+    others = {"2014.1120389237", "17-836", "2001.HA-C"}
+    for ref in refs:
+        key = encode_reference(ref)
+        if (key is None) != (ref in others):
+            print("Failed to classify", ref, "got key", key)
+        elif key is not None and decode_reference(key) != ref:
+            print("Failed to round-trip", ref, "got", decode_reference(key))
+        elif key is not None and encode_reference(decode_reference(key)) != key:
+            print("Failed to round-trip the key of", ref)
+    if encode_reference("2016.0266") == encode_reference("2016.266"):
+        print("Failed to keep leading zeros of 2016.0266")
+
+    index = ReferenceIndex.from_strings(refs + refs[:3])
+    if len(index) != len(refs) or sorted(index) != sorted(refs):
+        print("Failed to deduplicate, got", sorted(index))
+    if not all(ref in index for ref in refs) or "2017.CJD" in index:
+        print("Failed membership")
+    missing = index.missing(["2017.CJD", "2016.0266", "17-836", "17-837"])
+    if missing != ["2017.CJD", "17-837"]:
+        print("Failed missing, got", missing)
+    union = index.union(["2017.CJD", "17-837", "2020.3863"])
+    if len(union) != len(refs) + 2 or union.missing(refs + ["2017.CJD", "17-837"]):
+        print("Failed union, got", sorted(union))
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "references.idx")
+        index.save(path)
+        loaded = ReferenceIndex.load(path)
+        if list(loaded) != list(index):
+            print("Failed to load saved index, got", list(loaded))
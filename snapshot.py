@@ -0,0 +1,95 @@
+import json
+import os
+import tempfile
+import numpy as np
+
+# -----------------------------------------------------------------------------
+# Snapshot format
+# -----------------------------------------------------------------------------
+# A snapshot file is laid out as
+#
+#   magic (8 bytes) | header length (uint64) | header (json) | columns
+#
+# The header holds the dtype, offset and length of every column together with the
+# string tables the integer columns are coded against and a dict of metadata. Each
+# column is a fixed-width little-endian array starting at a multiple of ALIGNMENT, so
+# it can be mapped directly with numpy.memmap.
+MAGIC = b"RASFFSNP"
+VERSION = 2
+ALIGNMENT = 8
+
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def write_snapshot(path, columns, tables, meta=None):
+    """
+    Writes integer columns, string tables and metadata to a snapshot file.
+
+    columns is a dict of column name to numpy array, tables is a dict of table name to
+    list of strings and meta is a dict of json values. The file is written to a unique
+    temporary file and then replaced atomically, so concurrent writers do not mix their
+    data and processes that have the old snapshot mapped keep reading a consistent copy.
+    """
+    header = {"version": VERSION, "columns": {}, "tables": tables, "meta": meta or {}}
+    offset = 0
+    for name, column in columns.items():
+        dtype = column.dtype.newbyteorder("<")
+        header["columns"][name] = {
+            "dtype": dtype.str,
+            "offset": offset,
+            "length": len(column),
+        }
+        offset = _align(offset + len(column) * dtype.itemsize)
+
+    header_data = json.dumps(header).encode("utf-8")
+    data_start = _align(len(MAGIC) + 8 + len(header_data))
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(MAGIC)
+            f.write(np.array([len(header_data)], dtype="<u8").tobytes())
+            f.write(header_data)
+            for name, column in columns.items():
+                info = header["columns"][name]
+                f.write(b"\0" * (data_start + info["offset"] - f.tell()))
+                f.write(column.astype(info["dtype"], copy=False).tobytes())
+        # mkstemp creates the file readable by its owner only
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def load_snapshot(path):
+    """
+    Maps the columns of a snapshot file read-only.
+
+    Returns a dict of column name to numpy.memmap, a dict of table name to list of
+    strings and the dict of metadata.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a snapshot file" % path)
+        header_length = int(np.frombuffer(f.read(8), dtype="<u8")[0])
+        header = json.loads(f.read(header_length).decode("utf-8"))
+    if header["version"] != VERSION:
+        raise ValueError("%s has unsupported version %s" % (path, header["version"]))
+
+    data_start = _align(len(MAGIC) + 8 + header_length)
+    columns = {}
+    for name, info in header["columns"].items():
+        if info["length"] == 0:
+            columns[name] = np.empty(0, dtype=info["dtype"])
+            continue
+        columns[name] = np.memmap(
+            path,
+            dtype=info["dtype"],
+            mode="r",
+            offset=data_start + info["offset"],
+            shape=(info["length"],),
+        )
+    return columns, header["tables"], header["meta"]